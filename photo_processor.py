@@ -9,14 +9,24 @@ Image Processing Script for SFTP-received photos
 
 import os
 import time
+import asyncio
+import signal
+import threading
 import shutil
+import struct
 import logging
+import sqlite3
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import closing
 from datetime import datetime
+from functools import partial
+from logging.handlers import QueueHandler, QueueListener
 from pathlib import Path
 import cv2
 import numpy as np
-from PIL import Image
-from PIL.ExifTags import TAGS
 from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
 
@@ -34,32 +44,165 @@ logging.basicConfig(
 SOURCE_DIR = "/Users/laszlo/Downloads/"  # Mac built-in HDD
 DESTINATION_BASE_DIR = "/Users/laszlo/Downloads/processed_photos"  # External HDD
 SUPPORTED_EXTENSIONS = {".jpg", ".jpeg", ".nef", ".cr2", ".arw", ".raw", ".dng"}
-CHECK_INTERVAL = 5  # seconds
+RAW_EXTENSIONS = {".nef", ".cr2", ".arw", ".raw", ".dng"}
+FILE_SETTLE_POLL_INTERVAL = 0.1  # seconds between size checks on a new file
+FILE_SETTLE_MAX_POLLS = 300  # Give up waiting for a new file to settle after this many checks
+DUPLICATE_EVENT_WINDOW = 5  # seconds during which repeated events for a file are ignored
+SEEN_PATHS_LIMIT = 1024  # Number of recently seen files remembered for deduplication
 LAPLACIAN_THRESHOLD = 100  # Threshold for blurriness detection
 BOUQUET_COLOR_THRESHOLD = 0.15  # Threshold for potential bouquet detection
+EXIF_READ_LIMIT = 64 * 1024  # Bytes read from the start of RAW files when looking for EXIF data
+ANALYSIS_MAX_DIMENSION = 1024  # Long edge (px) images are downsampled to before analysis
+BOUQUET_SCAN_BANDS = 4  # Bands scanned for bouquet colors, allowing an early exit
+BOUQUET_SAMPLE_STEP = 2  # Only every Nth row and column is checked for bouquet colors
+MAX_WORKERS = os.cpu_count()  # Worker processes used to process images
+ANALYSIS_CACHE_FILENAME = ".cache.sqlite"  # Cache of processed files, kept in the destination directory
+
+def get_extension(file_path):
+    """Return the lowercase file extension, including the leading dot."""
+    return os.path.splitext(file_path)[1].lower()
 
 def create_directory_structure(base_dir):
     """Ensure the destination directory structure exists."""
     os.makedirs(base_dir, exist_ok=True)
     return base_dir
 
-def get_image_datetime(file_path):
-    """Extract capture time from image EXIF data."""
+def is_inside_directory(file_path, directory):
+    """Return True if file_path lies somewhere under directory."""
+    directory = os.path.realpath(directory)
+    return os.path.commonpath([os.path.realpath(file_path), directory]) == directory
+
+def iter_jpeg_segments(f):
+    """
+    Walk the JPEG header segments up to the image data.
+    Yields (marker, payload_length) with the file positioned at the segment payload.
+    """
+    while True:
+        marker = f.read(2)
+        if len(marker) < 2 or marker[0] != 0xFF or marker[1] in (0xD9, 0xDA):
+            return
+        length = int.from_bytes(f.read(2), "big")
+        if length < 2:
+            return
+        payload_start = f.tell()
+        yield marker[1], length - 2
+        f.seek(payload_start + length - 2)
+
+def read_jpeg_exif_segment(f):
+    """
+    Find the EXIF APP1 segment in the JPEG header.
+    Returns the TIFF block stored in it, or None if there is none.
+    """
+    for marker, length in iter_jpeg_segments(f):
+        if marker != 0xE1:
+            continue
+        
+        payload = f.read(length)
+        # APP1 is also used for XMP, so keep looking unless this is EXIF
+        if payload.startswith(b"Exif\x00\x00"):
+            return payload[6:]
+    return None
+
+def read_jpeg_size(file_path):
+    """
+    Read the image dimensions from the JPEG frame header.
+    Returns a (width, height) tuple, or None if the file is not a readable JPEG.
+    """
     try:
-        image = Image.open(file_path)
-        exif_data = image._getexif()
+        with open(file_path, "rb") as f:
+            if f.read(2) != b"\xff\xd8":
+                return None
+            for marker, length in iter_jpeg_segments(f):
+                # SOF0-SOF15, except DHT (0xC4), JPG (0xC8) and DAC (0xCC)
+                if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+                    height, width = struct.unpack(">xHH", f.read(5))
+                    return width, height
+    except Exception as e:
+        logging.warning(f"Error reading JPEG size for {file_path}: {e}")
+    return None
+
+def get_imread_flags(file_path):
+    """
+    Choose cv2.imread flags that let libjpeg decode at a reduced scale,
+    while keeping the long edge at least twice ANALYSIS_MAX_DIMENSION so the
+    area resize still averages away DCT-scaling artifacts.
+    """
+    size = read_jpeg_size(file_path)
+    if size is not None:
+        for factor, flags in ((8, cv2.IMREAD_REDUCED_COLOR_8),
+                              (4, cv2.IMREAD_REDUCED_COLOR_4),
+                              (2, cv2.IMREAD_REDUCED_COLOR_2)):
+            if max(size) >= ANALYSIS_MAX_DIMENSION * factor * 2:
+                return flags
+    return cv2.IMREAD_COLOR
+
+def parse_tiff_tags(data):
+    """
+    Parse the ASCII tags of IFD0 and the Exif sub-IFD from a TIFF block.
+    Returns a dict of tag id -> value.
+    """
+    byte_order = {b"II": "<", b"MM": ">"}[data[:2]]
+    tags = {}
+    pending_offsets = [struct.unpack_from(byte_order + "I", data, 4)[0]]
+    seen_offsets = set()
+    while pending_offsets:
+        ifd_offset = pending_offsets.pop()
+        # Skip IFDs that lie outside the bytes we read, or that were already parsed
+        if ifd_offset in seen_offsets or ifd_offset + 2 > len(data):
+            continue
+        seen_offsets.add(ifd_offset)
+        
+        (entry_count,) = struct.unpack_from(byte_order + "H", data, ifd_offset)
+        for entry_offset in range(ifd_offset + 2, ifd_offset + 2 + 12 * entry_count, 12):
+            if entry_offset + 12 > len(data):
+                break
+            tag, value_type, count, value = struct.unpack_from(byte_order + "HHII", data, entry_offset)
+            if tag == 0x8769:
+                # Pointer to the Exif sub-IFD, which holds DateTimeOriginal
+                pending_offsets.append(value)
+            elif value_type == 2:
+                # ASCII values of up to 4 bytes are stored in the entry itself
+                value_offset = entry_offset + 8 if count <= 4 else value
+                if value_offset + count <= len(data):
+                    raw_value = data[value_offset:value_offset + count]
+                    tags[tag] = raw_value.split(b"\x00", 1)[0].decode("ascii", "replace")
+    return tags
+
+def read_exif(file_path):
+    """
+    Read EXIF tags from the file header without decoding the image.
+    Handles JPEG files and TIFF-based RAW files (NEF, CR2, ARW, DNG).
+    Returns a dict of tag id -> value, or None if no EXIF data is present.
+    """
+    try:
+        with open(file_path, "rb") as f:
+            signature = f.read(4)
+            if signature[:2] == b"\xff\xd8":
+                f.seek(2)
+                tiff_data = read_jpeg_exif_segment(f)
+            elif signature in (b"II*\x00", b"MM\x00*"):
+                # The IFDs of TIFF-based RAW files sit near the start of the file
+                f.seek(0)
+                tiff_data = f.read(EXIF_READ_LIMIT)
+            else:
+                return None
         
+        if not tiff_data:
+            return None
+        return parse_tiff_tags(tiff_data)
+    except Exception as e:
+        logging.warning(f"Error reading EXIF data for {file_path}: {e}")
+        return None
+
+def get_image_datetime(file_path, exif_data):
+    """Extract capture time from image EXIF data."""
+    try:
         if not exif_data:
             # If no EXIF data, use file creation time
             return datetime.fromtimestamp(os.path.getctime(file_path))
         
-        # Look for DateTimeOriginal or DateTime EXIF tag
-        date_time = None
-        for tag_id, value in exif_data.items():
-            tag = TAGS.get(tag_id, tag_id)
-            if tag == "DateTimeOriginal" or tag == "DateTime":
-                date_time = value
-                break
+        # Look up the DateTimeOriginal (0x9003) or DateTime (0x0132) EXIF tag
+        date_time = exif_data.get(0x9003) or exif_data.get(0x0132)
         
         if date_time:
             # EXIF DateTime format: "YYYY:MM:DD HH:MM:SS"
@@ -72,71 +215,151 @@ def get_image_datetime(file_path):
         # Fallback to file creation time
         return datetime.fromtimestamp(os.path.getctime(file_path))
 
+# Per-thread scratch buffers reused across images (each worker process has its own)
+scratch_buffers = threading.local()
+
+def get_scratch_buffer(name, shape, dtype=np.uint8):
+    """
+    Return a reusable buffer of the given shape for the current thread.
+    The backing memory only grows, so changing image sizes rarely reallocate.
+    """
+    size = int(np.prod(shape))
+    buffer = getattr(scratch_buffers, name, None)
+    if buffer is None or buffer.dtype != dtype or buffer.size < size:
+        buffer = np.empty(size, dtype=dtype)
+        setattr(scratch_buffers, name, buffer)
+    return buffer[:size].reshape(shape)
+
+# Define HSV color ranges for common flower colors
+FLOWER_COLOR_RANGES = [
+    # Red flowers (wraps around hue spectrum)
+    [(0, 100, 100), (10, 255, 255)],
+    [(160, 100, 100), (180, 255, 255)],
+    # Pink/purple flowers
+    [(125, 50, 100), (155, 255, 255)],
+    # Yellow flowers
+    [(20, 100, 100), (40, 255, 255)],
+    # White flowers (low saturation, high value)
+    [(0, 0, 200), (180, 30, 255)]
+]
+
+def build_color_histogram_bins(color_ranges):
+    """
+    Split each HSV channel into bins at the color range boundaries, so every
+    bin of the 3D histogram lies either fully inside or fully outside a range.
+    Returns the lookup table mapping channel values to bin indices, the number
+    of bins per channel, and the flat indices of the histogram bins inside any range.
+    """
+    channel_edges = []
+    for channel in range(3):
+        edges = {0, 256}
+        for lower, upper in color_ranges:
+            edges.update((lower[channel], upper[channel] + 1))
+        channel_edges.append(sorted(edges))
+    
+    lut = np.zeros((256, 1, 3), dtype=np.uint8)
+    for channel, edges in enumerate(channel_edges):
+        for index, (start, end) in enumerate(zip(edges, edges[1:])):
+            lut[start:end, 0, channel] = index
+    
+    bin_counts = [len(edges) - 1 for edges in channel_edges]
+    flower_bins = np.zeros(bin_counts, dtype=bool)
+    for lower, upper in color_ranges:
+        flower_bins[tuple(
+            slice(edges.index(lower[channel]), edges.index(upper[channel] + 1))
+            for channel, edges in enumerate(channel_edges)
+        )] = True
+    return lut, bin_counts, np.flatnonzero(flower_bins)
+
+FLOWER_BIN_LUT, FLOWER_BIN_COUNTS, FLOWER_BIN_INDICES = build_color_histogram_bins(FLOWER_COLOR_RANGES)
+FLOWER_HISTOGRAM_RANGES = [limit for count in FLOWER_BIN_COUNTS for limit in (0, count)]
+
 def detect_possible_bouquet(image):
     """
     Detect if image might contain a bouquet based on color characteristics.
     Returns True if a bouquet is likely present.
     """
-    # Convert to HSV color space
-    hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
-    
-    # Define color ranges for common flower colors
-    color_ranges = [
-        # Red flowers (wraps around hue spectrum)
-        [(0, 100, 100), (10, 255, 255)],
-        [(160, 100, 100), (180, 255, 255)],
-        # Pink/purple flowers
-        [(125, 50, 100), (155, 255, 255)],
-        # Yellow flowers
-        [(20, 100, 100), (40, 255, 255)],
-        # White flowers (low saturation, high value)
-        [(0, 0, 200), (180, 30, 255)]
-    ]
+    # The color ratio is stable on a sparse sample, so only the sampled
+    # pixels are converted to HSV and classified
+    sample_width = max(1, image.shape[1] // BOUQUET_SAMPLE_STEP)
+    sample_height = max(1, image.shape[0] // BOUQUET_SAMPLE_STEP)
+    sample = get_scratch_buffer("bouquet_sample", (sample_height, sample_width, 3))
+    cv2.resize(image, (sample_width, sample_height), dst=sample, interpolation=cv2.INTER_NEAREST)
+    image = sample
     
     total_pixels = image.shape[0] * image.shape[1]
+    # Number of flower-colored pixels the ratio threshold corresponds to
+    threshold_pixels = int(BOUQUET_COLOR_THRESHOLD * total_pixels)
     flower_pixels = 0
     
-    # Check each color range
-    for lower, upper in color_ranges:
-        mask = cv2.inRange(hsv, np.array(lower), np.array(upper))
-        flower_pixels += cv2.countNonZero(mask)
-    
-    # Calculate the proportion of flower-colored pixels
-    flower_ratio = flower_pixels / total_pixels
+    # Scan the image in horizontal bands so we can stop as soon as
+    # enough flower-colored pixels have been found
+    band_height = -(-image.shape[0] // BOUQUET_SCAN_BANDS)
+    for top in range(0, image.shape[0], band_height):
+        band = image[top:top + band_height]
+        
+        # Convert to HSV color space
+        hsv = get_scratch_buffer("hsv", band.shape)
+        cv2.cvtColor(band, cv2.COLOR_BGR2HSV, dst=hsv)
+        
+        # Quantize pixels into the color range bins and count them with a
+        # histogram, then add up the bins that belong to flower colors
+        color_bins = get_scratch_buffer("color_bins", band.shape)
+        cv2.LUT(hsv, FLOWER_BIN_LUT, dst=color_bins)
+        histogram = cv2.calcHist([color_bins], [0, 1, 2], None,
+                                 FLOWER_BIN_COUNTS, FLOWER_HISTOGRAM_RANGES)
+        flower_pixels += int(histogram.ravel()[FLOWER_BIN_INDICES].sum())
+        
+        # Return True once the proportion of flower-colored pixels exceeds the threshold
+        if flower_pixels > threshold_pixels:
+            return True
     
-    # Return True if the ratio exceeds the threshold
-    return flower_ratio > BOUQUET_COLOR_THRESHOLD
+    return False
 
-def is_image_blurry(file_path):
+def is_image_blurry(file_path, image):
     """
     Detect if an image is blurry.
+    Takes the already decoded BGR image (None if it could not be decoded).
     Returns True for blurry images, False for sharp images.
     Adjusts threshold if a bouquet is detected.
     """
+    # For RAW files that cv2 can't read directly, just assume not blurry
+    # In production, you might want to use a RAW conversion library
+    if get_extension(file_path) in RAW_EXTENSIONS:
+        logging.info(f"Cannot process RAW file for blur detection: {file_path}")
+        return False
+    
     try:
-        # Read image
-        image = cv2.imread(file_path)
         if image is None:
-            # For RAW files that cv2 can't read directly, just assume not blurry
-            # In production, you might want to use a RAW conversion library
-            if any(file_path.lower().endswith(ext) for ext in [".nef", ".cr2", ".arw", ".raw", ".dng"]):
-                logging.info(f"Cannot process RAW file for blur detection: {file_path}")
-                return False
             logging.warning(f"Failed to load image: {file_path}")
             return False
         
+        # Downsample large images; the blur and color metrics are stable at this size
+        scale = ANALYSIS_MAX_DIMENSION / max(image.shape[:2])
+        if scale < 1:
+            image = cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        
         # Convert to grayscale
-        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        gray = get_scratch_buffer("gray", image.shape[:2])
+        cv2.cvtColor(image, cv2.COLOR_BGR2GRAY, dst=gray)
         
-        # Calculate Laplacian variance (measure of focus)
-        laplacian = cv2.Laplacian(gray, cv2.CV_64F)
-        laplacian_var = laplacian.var()
+        # Calculate Laplacian variance (measure of focus); the 8-bit response
+        # fits in int16, and meanStdDev gets the variance in a single pass
+        laplacian = get_scratch_buffer("laplacian", gray.shape, np.int16)
+        cv2.Laplacian(gray, cv2.CV_16S, dst=laplacian)
+        _, stddev = cv2.meanStdDev(laplacian)
+        laplacian_var = float(stddev[0, 0]) ** 2
         
-        # Check if image likely contains a bouquet
-        has_bouquet = detect_possible_bouquet(image)
+        # Check if image likely contains a bouquet; a bouquet only lowers the
+        # threshold, so the color analysis is skipped when it can't change the result
+        bouquet_threshold = LAPLACIAN_THRESHOLD * 0.7
+        if bouquet_threshold <= laplacian_var < LAPLACIAN_THRESHOLD:
+            has_bouquet = detect_possible_bouquet(image)
+        else:
+            has_bouquet = None
         
         # Adjust threshold if bouquet detected (bouquets tend to have more intrinsic blur)
-        adjusted_threshold = LAPLACIAN_THRESHOLD * 0.7 if has_bouquet else LAPLACIAN_THRESHOLD
+        adjusted_threshold = bouquet_threshold if has_bouquet else LAPLACIAN_THRESHOLD
         
         logging.info(f"Image: {file_path}, Laplacian var: {laplacian_var}, " 
                     f"Bouquet detected: {has_bouquet}, Threshold: {adjusted_threshold}")
@@ -149,52 +372,158 @@ def is_image_blurry(file_path):
         # Default to not blurry on error
         return False
 
-def determine_destination_path(file_path, base_dir):
+def setup_analysis_cache(base_dir):
+    """Create the analysis cache database and its table if needed."""
+    try:
+        with closing(sqlite3.connect(os.path.join(base_dir, ANALYSIS_CACHE_FILENAME))) as connection:
+            # WAL lets the worker processes read while another one writes; the
+            # mode is stored in the database file, so it only needs setting once
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS analysis ("
+                "path TEXT PRIMARY KEY, mtime_ns INTEGER, size INTEGER, "
+                "capture_time TEXT, blur_status TEXT)"
+            )
+    except Exception as e:
+        logging.warning(f"Error setting up analysis cache in {base_dir}: {e}")
+
+analysis_cache = threading.local()
+
+def get_analysis_cache(base_dir):
     """
-    Determine the destination path based on capture time and blur status.
-    Returns the full destination path.
+    Return the current thread's connection to the analysis cache.
+    It is opened on first use, so each worker process gets its own.
+    """
+    cache_path = os.path.join(base_dir, ANALYSIS_CACHE_FILENAME)
+    if getattr(analysis_cache, "path", None) != cache_path:
+        if getattr(analysis_cache, "connection", None) is not None:
+            analysis_cache.connection.close()
+        analysis_cache.connection = sqlite3.connect(cache_path, timeout=30)
+        analysis_cache.path = cache_path
+    return analysis_cache.connection
+
+def get_cached_analysis(file_path, base_dir):
+    """
+    Look up the capture time and blur status of an already processed file.
+    Returns None unless the file is unchanged since it was cached.
+    """
+    try:
+        stat = os.stat(file_path)
+        row = get_analysis_cache(base_dir).execute(
+            "SELECT capture_time, blur_status FROM analysis "
+            "WHERE path = ? AND mtime_ns = ? AND size = ?",
+            (file_path, stat.st_mtime_ns, stat.st_size)
+        ).fetchone()
+        if row is None:
+            return None
+        return datetime.fromisoformat(row[0]), row[1]
+    except Exception as e:
+        logging.warning(f"Error reading analysis cache for {file_path}: {e}")
+        return None
+
+def cache_analysis(file_path, base_dir, capture_time, blur_status):
+    """Remember the capture time and blur status of a processed file."""
+    try:
+        stat = os.stat(file_path)
+        with get_analysis_cache(base_dir) as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO analysis VALUES (?, ?, ?, ?, ?)",
+                (file_path, stat.st_mtime_ns, stat.st_size, capture_time.isoformat(), blur_status)
+            )
+    except Exception as e:
+        logging.warning(f"Error writing analysis cache for {file_path}: {e}")
+
+def analyze_image(file_path):
+    """
+    Determine the capture time and blur status of an image.
+    Returns a (capture_time, blur_status) tuple.
     """
-    # Get capture datetime
-    capture_time = get_image_datetime(file_path)
+    # Decode the image once and share it with the blur check; cv2 can't
+    # decode RAW files, so don't spend the I/O trying
+    if get_extension(file_path) in RAW_EXTENSIONS:
+        image = None
+    else:
+        # Large JPEGs are decoded straight at a fraction of their size
+        image = cv2.imread(file_path, get_imread_flags(file_path))
+    
+    # Get capture datetime from the EXIF header, without decoding again
+    capture_time = get_image_datetime(file_path, read_exif(file_path))
     
     # Check if image is blurry
-    blurry = is_image_blurry(file_path)
+    blurry = is_image_blurry(file_path, image)
     blur_status = "blurry" if blurry else "sharp"
     
+    return capture_time, blur_status
+
+def determine_destination_path(file_path, base_dir, capture_time, blur_status):
+    """
+    Determine the destination path based on capture time and blur status.
+    Returns the full destination path, which is the file's own path if it
+    is already in the right place.
+    """
     # Create directory structure: YYYY-MM-DD/HH/blur_status
     date_str = capture_time.strftime("%Y-%m-%d")
     hour_str = capture_time.strftime("%H")
     
     destination_dir = os.path.join(base_dir, date_str, hour_str, blur_status)
+    if os.path.dirname(os.path.abspath(file_path)) == os.path.abspath(destination_dir):
+        return file_path
     os.makedirs(destination_dir, exist_ok=True)
     
     # Preserve original filename
     filename = os.path.basename(file_path)
     destination_path = os.path.join(destination_dir, filename)
     
-    # Handle filename conflicts by adding a counter
+    # Handle filename conflicts by adding a counter; the name is claimed
+    # atomically so parallel workers never pick the same destination
     counter = 1
     name, ext = os.path.splitext(filename)
-    while os.path.exists(destination_path):
-        new_filename = f"{name}_{counter}{ext}"
-        destination_path = os.path.join(destination_dir, new_filename)
-        counter += 1
+    while True:
+        try:
+            os.close(os.open(destination_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            break
+        except FileExistsError:
+            new_filename = f"{name}_{counter}{ext}"
+            destination_path = os.path.join(destination_dir, new_filename)
+            counter += 1
     
     return destination_path
 
+def move_file(src_path, dest_path):
+    """Move a file, with a plain rename when both paths are on the same device."""
+    if os.stat(src_path).st_dev == os.stat(os.path.dirname(dest_path)).st_dev:
+        os.replace(src_path, dest_path)
+    else:
+        # Copies across devices keep the file timestamps
+        shutil.move(src_path, dest_path)
+
 def process_image(file_path, base_dir):
     """Process a single image file."""
     try:
         # Skip processing if not an image file
-        if not any(file_path.lower().endswith(ext) for ext in SUPPORTED_EXTENSIONS):
+        if get_extension(file_path) not in SUPPORTED_EXTENSIONS:
             logging.debug(f"Skipping non-image file: {file_path}")
             return False
         
+        # Files processed before are unchanged, so skip decoding them again
+        analysis = get_cached_analysis(file_path, base_dir)
+        if analysis is None:
+            analysis = analyze_image(file_path)
+        capture_time, blur_status = analysis
+        
         # Determine destination path
-        dest_path = determine_destination_path(file_path, base_dir)
+        dest_path = determine_destination_path(file_path, base_dir, capture_time, blur_status)
+        if dest_path == file_path:
+            logging.debug(f"Skipping already processed file: {file_path}")
+            return False
         
-        # Move the file
-        shutil.move(file_path, dest_path)
+        # Move the file, replacing the placeholder that claimed the name
+        try:
+            move_file(file_path, dest_path)
+        except Exception:
+            os.remove(dest_path)
+            raise
+        cache_analysis(dest_path, base_dir, capture_time, blur_status)
         logging.info(f"Processed {file_path} -> {dest_path}")
         return True
     
@@ -202,11 +531,32 @@ def process_image(file_path, base_dir):
         logging.error(f"Error processing {file_path}: {e}")
         return False
 
+async def wait_for_file_to_settle(file_path):
+    """
+    Wait until a file's size stops changing, so it is fully written.
+    Returns False if the file disappears while waiting.
+    """
+    previous_size = -1
+    for _ in range(FILE_SETTLE_MAX_POLLS):
+        try:
+            size = os.path.getsize(file_path)
+        except OSError:
+            return False
+        if size == previous_size and size > 0:
+            break
+        previous_size = size
+        await asyncio.sleep(FILE_SETTLE_POLL_INTERVAL)
+    return True
+
 class ImageHandler(FileSystemEventHandler):
-    """File system event handler for new image files."""
+    """File system event handler that queues new image files for processing."""
     
-    def __init__(self, base_dir):
+    def __init__(self, base_dir, queue, loop):
         self.base_dir = base_dir
+        self.queue = queue
+        self.loop = loop
+        # Recently queued paths and when they were seen, oldest first
+        self.seen_paths = OrderedDict()
     
     def on_created(self, event):
         """Handle file creation events."""
@@ -214,21 +564,100 @@ class ImageHandler(FileSystemEventHandler):
             return
         
         file_path = event.src_path
+        
+        # Files moved into the destination directory have already been processed
+        if is_inside_directory(file_path, self.base_dir):
+            return
+        
+        # Skip non-image files before queueing them
+        if get_extension(file_path) not in SUPPORTED_EXTENSIONS:
+            return
+        
+        # Some file systems report the same new file more than once
+        now = time.monotonic()
+        last_seen = self.seen_paths.get(file_path)
+        if last_seen is not None and now - last_seen < DUPLICATE_EVENT_WINDOW:
+            logging.debug(f"Ignoring duplicate event for {file_path}")
+            return
+        self.seen_paths[file_path] = now
+        self.seen_paths.move_to_end(file_path)
+        if len(self.seen_paths) > SEEN_PATHS_LIMIT:
+            self.seen_paths.popitem(last=False)
+        
         logging.info(f"New file detected: {file_path}")
         
-        # Wait a short time to ensure file is fully written
-        time.sleep(1)
+        # Hand the file over to the event loop; workers wait for it to be fully written
+        self.loop.call_soon_threadsafe(self.queue.put_nowait, file_path)
+
+async def process_new_files(queue, base_dir, executor, stop_event):
+    """Take new files off the queue and process them in the worker pool."""
+    loop = asyncio.get_running_loop()
+    while True:
+        file_path = await queue.get()
+        
+        # Wait until the file is fully written
+        if not await wait_for_file_to_settle(file_path):
+            logging.warning(f"File disappeared before it could be processed: {file_path}")
+            continue
         
-        # Process the image
-        process_image(file_path, self.base_dir)
+        # Process the image; a dead worker breaks the whole pool, so stop monitoring
+        try:
+            await loop.run_in_executor(executor, process_image, file_path, base_dir)
+        except BrokenProcessPool as e:
+            logging.error(f"Worker pool failed while processing {file_path}: {e}")
+            stop_event.set()
+            return
+
+async def monitor_directory(source_dir, base_dir, executor):
+    """Process new images arriving in the source directory until interrupted."""
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+    
+    # Set up file system observer for new files
+    event_handler = ImageHandler(base_dir, queue, loop)
+    observer = Observer()
+    observer.schedule(event_handler, source_dir, recursive=True)
+    observer.start()
+    
+    # Run until Ctrl+C or until the worker pool fails
+    stop_event = asyncio.Event()
+    loop.add_signal_handler(signal.SIGINT, stop_event.set)
+    
+    # One consumer per worker process, so bursts of new files are processed in parallel
+    workers = [
+        asyncio.create_task(process_new_files(queue, base_dir, executor, stop_event))
+        for _ in range(MAX_WORKERS)
+    ]
+    
+    logging.info(f"Monitoring {source_dir} for new images...")
+    await stop_event.wait()
+    
+    logging.info("Stopping image monitoring")
+    observer.stop()
+    observer.join()
+    for worker in workers:
+        worker.cancel()
+    await asyncio.gather(*workers, return_exceptions=True)
+
+def init_worker(log_queue):
+    """Set up a worker process: log through the main process, leave Ctrl+C to it."""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    
+    root_logger = logging.getLogger()
+    for handler in root_logger.handlers[:]:
+        root_logger.removeHandler(handler)
+        handler.close()
+    root_logger.addHandler(QueueHandler(log_queue))
 
-def process_existing_files(source_dir, base_dir):
-    """Process any existing files in the source directory."""
+def process_existing_files(source_dir, base_dir, executor):
+    """Process any existing files in the source directory in parallel."""
     logging.info(f"Processing existing files in {source_dir}")
-    for root, _, files in os.walk(source_dir):
-        for filename in files:
-            file_path = os.path.join(root, filename)
-            process_image(file_path, base_dir)
+    file_paths = [
+        os.path.join(root, filename)
+        for root, _, files in os.walk(source_dir)
+        for filename in files
+    ]
+    list(executor.map(partial(process_image, base_dir=base_dir), file_paths, chunksize=4))
 
 def main():
     """Main function to run the image processing system."""
@@ -236,24 +665,22 @@ def main():
     
     # Create destination directory structure
     create_directory_structure(DESTINATION_BASE_DIR)
+    setup_analysis_cache(DESTINATION_BASE_DIR)
     
-    # Process any existing files
-    process_existing_files(SOURCE_DIR, DESTINATION_BASE_DIR)
-    
-    # Set up file system observer for new files
-    event_handler = ImageHandler(DESTINATION_BASE_DIR)
-    observer = Observer()
-    observer.schedule(event_handler, SOURCE_DIR, recursive=True)
-    observer.start()
-    
+    # Only the main process writes to the log handlers; workers queue their records
+    log_queue = multiprocessing.Queue()
+    listener = QueueListener(log_queue, *logging.getLogger().handlers)
+    listener.start()
     try:
-        logging.info(f"Monitoring {SOURCE_DIR} for new images...")
-        while True:
-            time.sleep(CHECK_INTERVAL)
-    except KeyboardInterrupt:
-        logging.info("Stopping image monitoring")
-        observer.stop()
-    observer.join()
+        with ProcessPoolExecutor(max_workers=MAX_WORKERS, initializer=init_worker,
+                                 initargs=(log_queue,)) as executor:
+            # Process any existing files
+            process_existing_files(SOURCE_DIR, DESTINATION_BASE_DIR, executor)
+            
+            # Keep processing new files as they arrive
+            asyncio.run(monitor_directory(SOURCE_DIR, DESTINATION_BASE_DIR, executor))
+    finally:
+        listener.stop()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file